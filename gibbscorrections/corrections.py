@@ -7,17 +7,46 @@ A module that automatises the tedious process of retrieving a Gaussian 16 geomet
 point Orca calculation at that geometry. Of course, for a bunch of files at the same time.
 """
 import logging
+import mmap
 import multiprocessing
 import os
+import re
 import sys
 import argparse
+import itertools
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
 import cclib as cclib
+import numpy as np
 from cclib.parser.utils import convertor
 from gibbscorrections.molecule import Molecule
 from gibbscorrections.orca_job import OrcaJob
 
+# Conversion factor from eV to kcal/mol, used for all printed energies
+EV_TO_KCAL = convertor(1.0, "eV", "kcal/mol")
+
+# Subset of cclib data read directly from Gaussian log files. Field names and units follow cclib, so that the
+# get_* helpers work on either.
+_GaussianData = namedtuple(
+    "_GaussianData",
+    [
+        "atomcoords",
+        "atomnos",
+        "scfenergies",
+        "enthalpy",
+        "freeenergy",
+        "charge",
+        "mult",
+    ],
+)
+
+# Charge and multiplicity of the whole system (fragment lines carry extra text and are not matched)
+_CHARGE_RE = re.compile(
+    rb"^ Charge =\s*(-?\d+) Multiplicity =\s*(\d+)\s*$", re.MULTILINE
+)
+
 
 def main():
     """
@@ -36,49 +65,46 @@ def main():
     setup_logging()
     args = get_input_arguments()
 
-    # Parse input files
-    list_coordinates = [get_coordinates(mol) for mol in args["input_files"]]
-    list_atom_lists = [get_atom_lists(mol) for mol in args["input_files"]]
-    list_filenames = [get_file_name(file) for file in args["input_files"]]
-    list_energies = [get_energies(mol) for mol in args["input_files"]]
-    list_charges = [get_charge(mol) for mol in args["input_files"]]
-    list_multiplicities = [get_multiplicity(mol) for mol in args["input_files"]]
-
-    # Setup orca computations
-    molecules = [
-        Molecule(coordinates, list_of_atoms, charge, multiplicity)
-        for coordinates, list_of_atoms, charge, multiplicity in zip(
-            list_coordinates, list_atom_lists, list_charges, list_multiplicities
-        )
-    ]
-    basedir = Path().cwd()
-    orca_arguments = {
-        key: value
-        for key, value in args.items()
-        if key in ["functional", "basisset", "solvent"]
-    }
-    computations = [
-        OrcaJob(
-            molecule=mol,
-            name=name,
-            basedir=basedir,
-            job_id=name,
-            orca_args=orca_arguments,
-        )
-        for mol, name in zip(molecules, list_filenames)
-    ]
-
-    # Write orca files
-    [job.setup_computation() for job in computations]
-
-    # Run Orca jobs in parallel
+    # Orca jobs run in parallel
     # ncpu is the number of cpus available, minus 1 for python. Then, each orca run uses 4 cores, and we round.
-    n_jobs = int((int(os.environ["SLURM_JOB_CPUS_PER_NODE"])/2 - 1) / 4)
-    pool = multiprocessing.Pool(processes=n_jobs)
-    orca_results = pool.map(run_jobs, computations)
-
-    # Retrieve SCF energies
-    scf_energies = [result.get_energies()["scfenergy"] for result in orca_results]
+    n_jobs = max(1, int((int(os.environ["SLURM_JOB_CPUS_PER_NODE"])/2 - 1) / 4))
+
+    # A single pool of workers is used both to parse input files and to run Orca jobs
+    input_files = [file.as_posix() for file in args["input_files"]]
+    n_workers = max(min(len(input_files), multiprocessing.cpu_count()), n_jobs)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # Parse input files, in parallel and only once per file, and set up Orca computations in the same pass
+        basedir = Path().cwd()
+        orca_arguments = {
+            key: value
+            for key, value in args.items()
+            if key in ["functional", "basisset", "solvent"]
+        }
+        computations = []
+        list_energies = []
+        list_filenames = []
+        parsed_files = executor.map(_parse_one, input_files)
+        for coordinates, atom_list, energies, charge, mult, name in parsed_files:
+            computations.append(
+                OrcaJob(
+                    molecule=Molecule(coordinates, atom_list, charge, mult),
+                    name=name,
+                    basedir=basedir,
+                    job_id=name,
+                    orca_args=orca_arguments,
+                )
+            )
+            list_energies.append(energies)
+            list_filenames.append(name)
+
+        # Write orca files
+        [job.setup_computation() for job in computations]
+
+        # Run Orca jobs, no more than n_jobs at a time
+        scf_energies_by_name = _run_orca_jobs(executor, computations, n_jobs)
+
+    # Put SCF energies back in input order
+    scf_energies = [scf_energies_by_name[name] for name in list_filenames]
 
     # Print everything neatly to output file
     print_results(
@@ -86,43 +112,197 @@ def main():
     )
 
 
-def run_jobs(job):
-    job.run()
-    return job
+def _run_orca_jobs(executor, computations, n_jobs):
+    """
+    Run Orca jobs on the executor, with at most n_jobs running at the same time.
+
+    SCF energies are retrieved by the workers as soon as each job finishes, while the others are still running.
+    A failed job is logged and does not prevent the remaining jobs from running. Once all jobs have run, a
+    RuntimeError listing the failed jobs is raised if there are any.
+    Returns a dictionary of SCF energies, with job names as keys.
+    """
+    pending_jobs = iter(computations)
+    running = {
+        executor.submit(_run_one, job): job.name
+        for job in itertools.islice(pending_jobs, n_jobs)
+    }
+    scf_energies = dict()
+    failed_jobs = []
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                _, energies = future.result()
+                scf_energies[name] = energies["scfenergy"]
+            except Exception as error:
+                logging.error("Orca job %s failed: %s", name, error)
+                failed_jobs.append(name)
+            # Start next job in place of the finished one
+            next_job = next(pending_jobs, None)
+            if next_job is not None:
+                running[executor.submit(_run_one, next_job)] = next_job.name
+    if failed_jobs:
+        raise RuntimeError("Orca jobs failed: " + ", ".join(failed_jobs))
+    return scf_energies
+
+
+def _run_one(job):
+    """
+    Run an Orca job and extract its energies, in a worker process.
+
+    Only the job name and the energies dictionary are sent back, instead of the whole job.
+    Raises RuntimeError if Orca did not terminate normally, so that no energy is read from a broken output.
+    """
+    if not job.run():
+        raise RuntimeError("Orca did not terminate normally")
+    return job.name, job.get_energies()
 
 
 def print_results(out_file, scf_energies, list_energies, list_filenames):
     """Print results from Orca calculations together with gaussian original results and corrected values"""
-    with open(out_file, mode="w") as outfile:
-        header = "Name\tGaussian SCF\tGaussian H\tGaussian G\tOrca SCF\tOrca H\tOrca G"
-        outfile.write(header + "\n")
-        for name, orca_energy, gaussian_energies in zip(
-            list_filenames, scf_energies, list_energies
-        ):
-            # Create all intermediate data to print
-            orca_freeenergy = orca_energy + gaussian_energies["freeenergy_correction"]
-            orca_enthalpy = orca_energy + gaussian_energies["enthalpy_correction"]
-
-            energies = [
+    # Gather all energies in a single (N, 6) table
+    energies = np.array(
+        [
+            [
                 gaussian_energies["scfenergy"],
                 gaussian_energies["enthalpy"],
                 gaussian_energies["freeenergy"],
                 orca_energy,
-                orca_enthalpy,
-                orca_freeenergy,
+                orca_energy + gaussian_energies["enthalpy_correction"],
+                orca_energy + gaussian_energies["freeenergy_correction"],
             ]
+            for orca_energy, gaussian_energies in zip(scf_energies, list_energies)
+        ],
+        dtype=np.float64,
+    )
 
-            # Convert to kcal/mol from Hartree
-            energies_kcal = [str(convertor(val, "eV", "kcal/mol")) for val in energies]
+    # Convert to kcal/mol from eV, all at once
+    energies_kcal = energies * EV_TO_KCAL
 
-            # Create line
-            line = name + "\t" + "\t".join(energies_kcal)
-            outfile.write(line + "\n")
+    with open(out_file, mode="w") as outfile:
+        header = "Name\tGaussian SCF\tGaussian H\tGaussian G\tOrca SCF\tOrca H\tOrca G"
+        outfile.write(header + "\n")
+        outfile.writelines(
+            name + "\t" + "\t".join(map(str, row)) + "\n"
+            for name, row in zip(list_filenames, energies_kcal.tolist())
+        )
+
+
+def _load(comp_file):
+    """Parse a calculation log file with cclib. Path is used as given, input files are resolved at startup."""
+    return cclib.io.ccread(str(comp_file))
+
+
+def _rest_of_last_line(log, marker):
+    """Return the end of the last line containing marker, after the marker, or None if it is not found"""
+    start = log.rfind(marker)
+    if start == -1:
+        return None
+    start += len(marker)
+    end = log.find(b"\n", start)
+    return log[start : end if end != -1 else len(log)]
+
+
+def _read_orientation(log, start):
+    """
+    Read atomic numbers and coordinates from the Gaussian orientation block whose title starts at start.
+
+    Returns None if the block is truncated or cannot be read.
+    """
+    # Skip title line and table header
+    position = start
+    for _ in range(5):
+        position = log.find(b"\n", position)
+        if position == -1:
+            return None
+        position += 1
+    end = log.find(b"\n ---", position)
+    if end == -1:
+        return None
+    atom_list = []
+    coordinates = []
+    try:
+        for line in log[position:end].splitlines():
+            fields = line.split()
+            atom_list.append(int(fields[1]))
+            coordinates.append([float(coord) for coord in fields[3:6]])
+    except (IndexError, ValueError):
+        return None
+    if not atom_list or any(len(coords) != 3 for coords in coordinates):
+        return None
+    return atom_list, coordinates
+
+
+def _read_gaussian_log(comp_file):
+    """
+    Read final geometry, energies, charge and multiplicity from a Gaussian log file.
+
+    Much faster than a full cclib parse: the file is memory-mapped, and only the last occurrence of each datum is
+    looked up, searching backwards from the end of the file.
+    Returns a _GaussianData, or None if anything is missing, in which case cclib should be used instead.
+    """
+    with open(comp_file, mode="rb") as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            # Like cclib, prefer standard orientation when Gaussian printed it
+            orientation_start = log.rfind(b"Standard orientation:")
+            if orientation_start == -1:
+                orientation_start = log.rfind(b"Input orientation:")
+            scf_line = _rest_of_last_line(log, b" SCF Done:")
+            enthalpy = _rest_of_last_line(
+                log, b" Sum of electronic and thermal Enthalpies="
+            )
+            freeenergy = _rest_of_last_line(
+                log, b" Sum of electronic and thermal Free Energies="
+            )
+            charges = _CHARGE_RE.findall(log)
+            if orientation_start == -1 or not charges:
+                return None
+            if None in (scf_line, enthalpy, freeenergy):
+                return None
+            orientation = _read_orientation(log, orientation_start)
+            if orientation is None:
+                return None
+            atom_list, coordinates = orientation
+
+    charge, mult = charges[-1]
+    scfenergy = float(scf_line.split(b"=")[1].split()[0])
+    return _GaussianData(
+        atomcoords=np.array([coordinates], dtype=np.float64),
+        atomnos=np.array(atom_list),
+        scfenergies=[convertor(scfenergy, "hartree", "eV")],
+        enthalpy=float(enthalpy),
+        freeenergy=float(freeenergy),
+        charge=int(charge),
+        mult=int(mult),
+    )
+
+
+def _parse_one(comp_file):
+    """
+    Parse a Gaussian calculation log file once, and extract everything needed to set up the Orca job.
+
+    Top-level function so that it can be used by multiprocessing workers.
+    Returns a tuple (coordinates, atom list, energies, charge, multiplicity, file name)
+    """
+    file = _read_gaussian_log(comp_file)
+    if file is None:
+        logging.info("Falling back to cclib to parse %s", comp_file)
+        file = _load(comp_file)
+    return (
+        get_coordinates(file),
+        get_atom_lists(file),
+        get_energies(file),
+        get_charge(file),
+        get_multiplicity(file),
+        get_file_name(comp_file),
+    )
 
 
-def get_energies(comp_file):
-    """Retrieve energies from calculation log file"""
-    file = cclib.io.ccread(comp_file.resolve().as_posix())
+def get_energies(file):
+    """Retrieve energies from parsed Gaussian calculation data"""
     energies = dict.fromkeys(
         [
             "scfenergy",
@@ -145,27 +325,23 @@ def get_energies(comp_file):
     return energies
 
 
-def get_coordinates(comp_file):
-    """Retrieve coordinates from Gaussian calculation log file"""
-    file = cclib.io.ccread(comp_file.resolve().as_posix())
+def get_coordinates(file):
+    """Retrieve coordinates from parsed Gaussian calculation data"""
     return file.atomcoords[-1]
 
 
-def get_charge(comp_file):
-    """Retrieve charge from Gaussian calculation log file"""
-    file = cclib.io.ccread(comp_file.resolve().as_posix())
+def get_charge(file):
+    """Retrieve charge from parsed Gaussian calculation data"""
     return file.charge
 
 
-def get_multiplicity(comp_file):
-    """Retrieve charge from Gaussian calculation log file"""
-    file = cclib.io.ccread(comp_file.resolve().as_posix())
+def get_multiplicity(file):
+    """Retrieve multiplicity from parsed Gaussian calculation data"""
     return file.mult
 
 
-def get_atom_lists(comp_file):
+def get_atom_lists(file):
     """Returns the list of atoms in the input order"""
-    file = cclib.io.ccread(comp_file.resolve().as_posix())
     atom_list = file.atomnos.tolist()
     return atom_list
 
@@ -249,8 +425,8 @@ def get_input_arguments():
         print(str(error))  # Print something like "option -a not recognized"
         sys.exit(2)
 
-    # Setup file names
-    values["input_files"] = [Path(i) for i in args.input_files]
+    # Setup file names, input files are resolved once and for all
+    values["input_files"] = [Path(i).resolve() for i in args.input_files]
     logger.debug("Input files: %s", values["input_files"])
     values["output_file"] = Path(args.output_file[0])
     logger.debug("Output file: %s", values["output_file"])
@@ -4,26 +4,49 @@
 
 """Class representing a molecule"""
 
+import functools
+
+import numpy as np
 from cclib.parser.utils import PeriodicTable
 
+# One line of XYZ geometry: element symbol, then X, Y and Z coordinates
+_XYZ_LINE_FORMAT = "%-5s %25.6f %25.6f %25.6f"
+
+
+@functools.cache
+def _element_symbols():
+    """Element symbols indexed by atomic number, built on first use and shared by all molecules"""
+    return tuple(PeriodicTable().element)
+
 
 class Molecule:
     """
     Class that represents a molecule
 
     Attributes:
-        - coordinates (list of XYZ coordinates)
+        - coordinates (XYZ coordinates, contiguous (natoms, 3) float64 numpy array)
         - natoms (number of atoms, int)
-        - elements_list (list of elements as in periodic table class from cclib)
+        - elements_list (tuple of elements as in periodic table class from cclib)
 
     """
 
+    __slots__ = (
+        "_coordinates",
+        "_elements_list",
+        "_symbols",
+        "_natoms",
+        "_charge",
+        "_multiplicity",
+    )
+
     def __init__(self, coordinates, elements_list, charge, multiplicity):
         """Build  the Molecule class."""
         if not len(coordinates) == len(elements_list):
             raise ValueError("Coordinates and Elements are not the same size")
-        self._coordinates = coordinates
-        self._elements_list = elements_list
+        self._coordinates = np.ascontiguousarray(coordinates, dtype=np.float64)
+        self._elements_list = tuple(int(element) for element in elements_list)
+        symbols = _element_symbols()
+        self._symbols = tuple(symbols[element] for element in self._elements_list)
         self._natoms = len(elements_list)
         self._charge = charge
         self._multiplicity = multiplicity
@@ -37,7 +60,7 @@ class Molecule:
     def coordinates(self, value):
         if not len(value) == self.natoms:
             raise ValueError("Coordinates and Elements are not the same size")
-        self._coordinates = value
+        self._coordinates = np.ascontiguousarray(value, dtype=np.float64)
 
     @property
     def elements_list(self):
@@ -48,7 +71,9 @@ class Molecule:
     def elements_list(self, value):
         if not len(value) == self.natoms:
             raise ValueError("Coordinates and Elements are not the same size")
-        self._elements_list = value
+        self._elements_list = tuple(int(element) for element in value)
+        symbols = _element_symbols()
+        self._symbols = tuple(symbols[element] for element in self._elements_list)
 
     @property
     def natoms(self):
@@ -79,14 +104,9 @@ class Molecule:
 
     def xyz_geometry(self):
         """Returns geometry in XYZ format"""
-        periodic_table = PeriodicTable()
-
         xyz_geometry = [
-            " ".join(
-                [periodic_table.element[self.elements_list[i]].ljust(5)]
-                + ["{:.6f}".format(s).rjust(25) for s in atom]
-            )
-            for i, atom in enumerate(self.coordinates)
+            _XYZ_LINE_FORMAT % (symbol, x, y, z)
+            for symbol, (x, y, z) in zip(self._symbols, self.coordinates.tolist())
         ]
 
         return xyz_geometry
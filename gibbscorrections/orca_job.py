@@ -3,11 +3,155 @@
 # Copyright (c) 2019, E. Nicolas
 
 """Orca Job class to start job, run it and analyze it"""
+import functools
+import io
 import logging
+import mmap
 import os
+import re
 from pathlib import Path
 import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 from cclib.io import ccread
+from cclib.parser.utils import convertor
+
+# Energies printed by Orca near the end of its output, all in Hartree
+_SCF_ENERGY_RE = re.compile(rb"FINAL SINGLE POINT ENERGY\s+(-?\d+\.\d+)")
+_ENTHALPY_RE = re.compile(rb"Total Enthalpy\s+\.\.\.\s+(-?\d+\.\d+) Eh")
+# Older Orca versions print "free enthalpy" instead of "free energy", cclib accepts both
+_FREEENERGY_RE = re.compile(
+    rb"Final Gibbs free (?:energy|enthalpy)\s+\.\.\.\s+(-?\d+\.\d+) Eh"
+)
+
+# Title of the cartesian coordinates block, followed by a line of dashes then one line per atom
+_COORDINATES_MARKER = b"CARTESIAN COORDINATES (ANGSTROEM)"
+
+# NBO summary table: title line, then 5 lines of table header before one line per atom
+_NPA_MARKER = b"Summary of Natural Population Analysis:"
+_NPA_RE = re.compile(re.escape(_NPA_MARKER) + rb"[^\n]*\n(?:[^\n]*\n){5}")
+
+
+def _energies_from_tail(output_file, tail_size=65536):
+    """
+    Retrieve energies from the end of an Orca output file, without a full cclib parse.
+
+    Returns a dictionary with the same content as a cclib parse (SCF energy in eV, enthalpy and free energy in
+    Hartree, or None when absent), or None if no final energy could be found in the tail of the file.
+    """
+    with open(output_file, "rb") as out_file:
+        out_file.seek(0, os.SEEK_END)
+        out_file.seek(max(0, out_file.tell() - tail_size))
+        tail = out_file.read()
+
+    scf_energies = _SCF_ENERGY_RE.findall(tail)
+    if not scf_energies:
+        return None
+    enthalpies = _ENTHALPY_RE.findall(tail)
+    freeenergies = _FREEENERGY_RE.findall(tail)
+    return {
+        "scfenergy": convertor(float(scf_energies[-1]), "hartree", "eV"),
+        "enthalpy": float(enthalpies[-1]) if enthalpies else None,
+        "freeenergy": float(freeenergies[-1]) if freeenergies else None,
+    }
+
+
+@functools.cache
+def _cleanup_executor():
+    """
+    Background threads shared by all jobs to remove directories, since removals are I/O bound.
+
+    Created on first use, so that processes that never clean up (like pool workers) do not get one.
+    Pending removals are waited for when the interpreter exits.
+    """
+    return ThreadPoolExecutor(max_workers=8)
+
+
+def _log_cleanup_error(future):
+    """Log failure of a background directory removal, which nobody may be waiting for"""
+    error = future.exception()
+    if error is not None:
+        logging.error("Could not remove directory: %s", error)
+
+
+def _end_of_lines(data, start, n_lines):
+    """Return the position right after the n_lines-th newline found from start, or -1 if there are not enough"""
+    position = start
+    for _ in range(n_lines):
+        position = data.find(b"\n", position)
+        if position == -1:
+            return -1
+        position += 1
+    return position
+
+
+def _coordinates_from_output(output_file, natoms):
+    """
+    Retrieve the last cartesian coordinates printed in an Orca output file, without a full cclib parse.
+
+    Returns a (natoms, 3) array in Angstroms, or None if no coordinates block was found.
+    """
+    with open(output_file, "rb") as out_file:
+        if os.fstat(out_file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(out_file.fileno(), 0, access=mmap.ACCESS_READ) as output:
+            position = output.rfind(_COORDINATES_MARKER)
+            if position == -1:
+                return None
+            # Skip title and dashes lines
+            position = _end_of_lines(output, position, 2)
+            if position == -1:
+                return None
+            block_end = _end_of_lines(output, position, natoms)
+            # Truncated output file
+            if block_end == -1:
+                return None
+            block = output[position:block_end]
+    return np.loadtxt(io.BytesIO(block), usecols=(1, 2, 3), ndmin=2)
+
+
+def _parse(output_file):
+    """Parse an Orca output file with cclib. Top-level function, so that it can be used by worker processes."""
+    return ccread(output_file, loglevel=logging.WARNING)
+
+
+def _parse_if_needed(output_file, natoms):
+    """
+    Parse an Orca output file with cclib, only if the fast readers cannot get energies or coordinates from it.
+
+    Returns the cclib data, or None if no parse was needed or the output file is missing.
+    Top-level function, so that it can be used by worker processes.
+    """
+    if not os.path.exists(output_file):
+        logging.warning("No output file to parse: %s", output_file)
+        return None
+    if (
+        _energies_from_tail(output_file) is not None
+        and _coordinates_from_output(output_file, natoms) is not None
+    ):
+        return None
+    return _parse(output_file)
+
+
+def parse_many(jobs, max_workers=None):
+    """
+    Parse with cclib, in parallel, the output files of the jobs for which the fast readers fail.
+
+    get_energies and get_coordinates read most outputs directly and never need cclib. Each worker tries the fast
+    readers first, and only parses with cclib when they fail, so that the cclib cache of those jobs is filled.
+    Jobs that were already parsed are skipped, and jobs without output file are logged and left alone.
+    """
+    pending_jobs = [job for job in jobs if job._ccdata is None]
+    if not pending_jobs:
+        return
+    output_files = [job._output_path.as_posix() for job in pending_jobs]
+    natoms = [job.molecule.natoms for job in pending_jobs]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_parse_if_needed, output_files, natoms)
+        for job, data in zip(pending_jobs, results):
+            if data is not None:
+                job._ccdata = data
 
 
 class OrcaJob:
@@ -28,6 +172,21 @@ class OrcaJob:
 
     """
 
+    __slots__ = (
+        "_name",
+        "_molecule",
+        "_job_id",
+        "_basedir",
+        "_path",
+        "_input_path",
+        "_output_path",
+        "filenames",
+        "_orca_args",
+        "_header",
+        "_geometry",
+        "_ccdata",
+    )
+
     def __init__(self, basedir, name, molecule, job_id, orca_args):
         """Build  the OrcaJob class."""
         # Populate the class attributes
@@ -35,18 +194,35 @@ class OrcaJob:
         self._molecule = molecule
         self._job_id = job_id
         self._basedir = basedir
+        self._path = None
+        self._input_path = None
+        self._output_path = None
         self.filenames = dict()
-        self.filenames["input"] = self.name.replace(" ", "_") + ".inp"
-        self.filenames["output"] = self.name.replace(" ", "_") + ".out"
+        self._update_paths()
         self._orca_args = orca_args
+        # Header and geometry block, built on first access
+        self._header = None
+        self._geometry = None
+        # Output file parsed by cclib, on first use
+        self._ccdata = None
 
     @property
     def path(self):
         """
-        Computation path, calculated at will as: /basedir/my_name.00job_id/
+        Computation path: /basedir/my_name/, computed when name or basedir change
         """
-        path = Path().joinpath(self.basedir, self.name)
-        return path
+        return self._path
+
+    def _update_paths(self):
+        """Compute computation path, file names and full file paths from job name and base directory"""
+        safe_name = self.name.replace(" ", "_")
+        self._path = Path(self.basedir, self.name)
+        self.filenames["input"] = safe_name + ".inp"
+        self.filenames["output"] = safe_name + ".out"
+        self._input_path = self._path / self.filenames["input"]
+        self._output_path = self._path / self.filenames["output"]
+        # Output file changed, previous parse does not apply anymore
+        self._ccdata = None
 
     @property
     def molecule(self):
@@ -56,6 +232,8 @@ class OrcaJob:
     @molecule.setter
     def molecule(self, value):
         self._molecule = value
+        # Geometry block depends on molecule, rebuild it on next access
+        self._geometry = None
 
     @property
     def name(self):
@@ -65,6 +243,7 @@ class OrcaJob:
     @name.setter
     def name(self, value):
         self._name = value
+        self._update_paths()
 
     @property
     def job_id(self):
@@ -83,16 +262,21 @@ class OrcaJob:
     @basedir.setter
     def basedir(self, value):
         self._basedir = value
+        self._update_paths()
 
     @property
     def header(self):
-        """Computation header"""
-        return self.build_header()
+        """Computation header, built on first access"""
+        if self._header is None:
+            self._header = self.build_header()
+        return self._header
 
     @property
     def geometry(self):
-        """Computation footer"""
-        return self.get_geometry_block()
+        """Computation geometry block, built on first access"""
+        if self._geometry is None:
+            self._geometry = self.get_geometry_block()
+        return self._geometry
 
     @property
     def orca_args(self):
@@ -107,53 +291,115 @@ class OrcaJob:
     @orca_args.setter
     def orca_args(self, value):
         self._orca_args = value
+        # Header depends on Orca arguments, rebuild it on next access
+        self._header = None
 
     def run(self):
-        """Start the job."""
+        """
+        Start the job.
+
+        Returns True if Orca terminated normally (or had already been run), False otherwise.
+        """
         # Log computation start
         logging.info("Starting Orca: %s", str(self.name))
-        # Get into workdir, if computation not already done start Orca, then back to basedir
-        os.chdir(self.path)
+        # If computation not already done, start Orca in its working directory
         if self.computation_finished():
             logging.info("Orca was not started: %s was already computed", str(self.name))
-        else:
-            os.system(
-                "$ORCA_BIN_DIR/orca "
-                + self.filenames["input"]
-                + " > "
-                + self.filenames["output"]
+            return True
+        orca_bin = os.path.join(os.environ["ORCA_BIN_DIR"], "orca")
+        with open(self._output_path, mode="wb") as out_file:
+            process = subprocess.run(
+                [orca_bin, self.filenames["input"]],
+                cwd=self.path,
+                stdin=subprocess.DEVNULL,
+                stdout=out_file,
+                check=False,
+            )
+        # Output file was rewritten, previous parse is obsolete
+        self._ccdata = None
+        if process.returncode != 0:
+            logging.error(
+                "Orca exited with code %d: %s", process.returncode, str(self.name)
             )
-            logging.info("Orca finished: %s", str(self.name))
-        os.chdir(self.basedir)
         # Log end of computation
         logging.info("Orca finished: %s", str(self.name))
-        return
+        return process.returncode == 0 and self.computation_finished()
 
     def computation_finished(self):
-        """Check if computation in current directory is finished."""
-        if os.path.isfile(self.filenames["output"]):
-            with open(self.filenames["output"], "r") as out_file:
-                for line in out_file.readlines():
-                    if "****ORCA TERMINATED NORMALLY****" in line:
-                        return True
-        return False
+        """
+        Check if computation in current directory is finished.
+
+        Orca prints its termination banner at the very end of the output, so only the tail of the file is read.
+        Missing or tiny output files (Orca's banner alone is larger than 1 KiB) are not even opened.
+        """
+        output_file = self._output_path
+        try:
+            output_size = os.stat(output_file).st_size
+        except FileNotFoundError:
+            return False
+        if output_size < 1024:
+            return False
+        with open(output_file, "rb") as out_file:
+            out_file.seek(max(0, output_size - 4096))
+            return b"****ORCA TERMINATED NORMALLY****" in out_file.read()
 
     def extract_natural_charges(self):
-        """Extract NBO Charges parsing the output file."""
+        """
+        Extract NBO Charges parsing the output file.
+
+        The output file is memory-mapped and the last NBO summary table is located with a regex, then the charges
+        of all atoms are read into a numpy array. Returns an array of charges, or None if no NBO summary was found.
+        """
         # Log start
         logging.info("Parsing results from computation %s", str(self.job_id))
-        pass
+
+        output_file = self._output_path
+        try:
+            output_size = os.stat(output_file).st_size
+        except FileNotFoundError:
+            output_size = 0
+        if output_size == 0:
+            logging.warning("No output for NBO charges of job %s", str(self.job_id))
+            return None
+        with open(output_file, "rb") as out_file, mmap.mmap(
+            out_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as output:
+            table_start = output.rfind(_NPA_MARKER)
+            table = _NPA_RE.match(output, table_start) if table_start != -1 else None
+            if table is None:
+                logging.warning("No NBO charges found for job %s", str(self.job_id))
+                return None
+            block_end = _end_of_lines(output, table.end(), self.molecule.natoms)
+            if block_end == -1:
+                logging.warning("Truncated NBO charges for job %s", str(self.job_id))
+                return None
+            block = output[table.end() : block_end]
+
+        # Each line ends with charge, core, valence, Rydberg and total populations. Read the charge from the right,
+        # since atom label and number are stuck together from 100 atoms on (e.g. "C100").
+        charges = np.array(
+            [float(line.split()[-5]) for line in block.splitlines()], dtype=np.float64
+        )
+
+        logging.debug("ID %s: Charges = %s", str(self.job_id), charges)
+        return charges
+
+    def _data(self):
+        """Output file parsed by cclib. Parsed only once, and reused afterwards."""
+        if self._ccdata is None:
+            self._ccdata = _parse(self._output_path.as_posix())
+        return self._ccdata
 
     def get_coordinates(self):
         """Extract coordinates from output file."""
         # Log start
         logging.info("Extracting coordinates for job %s", str(self.job_id))
 
-        # Get into working directory
-        os.chdir(self.path)
-
-        # Parse file with cclib
-        data = ccread(self.filenames["output"], loglevel=logging.WARNING)
+        # Read coordinates block directly, parse file with cclib only if it was not found
+        coordinates = _coordinates_from_output(self._output_path, self.molecule.natoms)
+        if coordinates is not None:
+            return coordinates
+        data = self._data()
 
         #  Return the first coordinates, since it is a single point
         return data.atomcoords[0]
@@ -164,42 +410,41 @@ class OrcaJob:
 
         Create working directory, write input file
         """
-        # Create working directory
-        os.makedirs(self.path, mode=0o777, exist_ok=True)
-        logging.info("Created directory %s", self.path)
-        # Go into working directory
-        os.chdir(self.path)
-        # Write input file
-        with open(self.filenames["input"], mode="w") as input_file:
-            input_file.write("\n".join(self.build_input_script()))
+        # Create working directory. Base directory already exists, so a single mkdir is enough
+        try:
+            os.mkdir(self.path, mode=0o777)
+            logging.info("Created directory %s", self.path)
+        except FileExistsError:
+            logging.info("Directory %s already exists", self.path)
+        # Write input file line by line, without building the whole file in memory
+        with open(self._input_path, mode="w") as input_file:
+            self.write_input_script(input_file)
         logging.debug("Wrote file %s", self.filenames["input"])
-        # Get back to base directory
-        os.chdir(self.basedir)
 
     def get_energies(self):
         """
         Retrieve HF energies plus thermochemical corrections
 
+        Energies are read from the end of the output file, cclib is only used if that fails.
         :return:
         """
         # Log start
         logging.info("Extracting energies from %s", self.name)
 
-        # Get into working directory
-        os.chdir(self.path)
+        # Fast path: final energies are printed at the end of the file
+        energies = _energies_from_tail(self._output_path)
+        if energies is not None:
+            return energies
 
         # Parse file with cclib
-        data = ccread(self.filenames["output"], loglevel=logging.WARNING)
+        data = self._data()
 
         #  Return the parsed energies as a dictionary
-        energies = dict.fromkeys(["scfenergy", "enthalpy", "freeenergy"])
-        energies["scfenergy"] = data.scfenergies[-1]
-        energies["enthalpy"] = data.enthalpy if hasattr(data, "enthalpy") else None
-        energies["freeenergy"] = (
-            data.freeenergy if hasattr(data, "freeenergy") else None
-        )
-
-        return energies
+        return {
+            "scfenergy": data.scfenergies[-1],
+            "enthalpy": getattr(data, "enthalpy", None),
+            "freeenergy": getattr(data, "freeenergy", None),
+        }
 
     def build_header(self):
         """
@@ -221,7 +466,8 @@ class OrcaJob:
         header.append("")
         header.append("%pal nprocs 4 end")
         header.append("")
-        logging.debug("Header: \n %s", "\n".join(header))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Header: \n %s", "\n".join(header))
         return header
 
     def get_geometry_block(self):
@@ -235,7 +481,9 @@ class OrcaJob:
         ]
         block.extend(self.molecule.xyz_geometry())
         block.append("*")
-        logging.debug("Geometry block: \n %s", "\n".join(block))
+        # Only join the geometry when it is going to be printed
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Geometry block: \n %s", "\n".join(block))
         return block
 
     def get_solvation_block(self):
@@ -249,27 +497,42 @@ class OrcaJob:
         ]
         return block
 
-    def build_input_script(self):
-        """Build full input script"""
-        script = []
+    def _iter_input_script(self):
+        """Generate the lines of the full input script, in order"""
         # Put header
-        script.extend(self.header)
+        yield from self.header
 
         # Include solvent if it has been set
         if self.orca_args["solvent"]:
-            script.extend(self.get_solvation_block())
-            script.append("")
+            yield from self.get_solvation_block()
+            yield ""
 
         # Add geometry
-        script.extend(self.geometry)
+        yield from self.geometry
 
         # Add one blank line to finish file
-        script.append("")
+        yield ""
 
-        return script
+    def build_input_script(self):
+        """Build full input script, as a list of strings"""
+        return list(self._iter_input_script())
+
+    def write_input_script(self, input_file):
+        """Write full input script to an open file, line by line"""
+        lines = self._iter_input_script()
+        input_file.write(next(lines))
+        for line in lines:
+            input_file.write("\n")
+            input_file.write(line)
 
     def cleanup(self):
-        """Removing folders and files once everything is run and extracted"""
+        """
+        Removing folders and files once everything is run and extracted
+
+        Removal happens in a background thread, so that several jobs can be cleaned up at the same time.
+        Returns a future, whose result() waits for the removal to complete; failures are logged.
+        """
         logging.info("Removing directory: %s", str(self.path))
-        shutil.rmtree(self.path)
-        return
+        future = _cleanup_executor().submit(shutil.rmtree, self.path)
+        future.add_done_callback(_log_cleanup_error)
+        return future
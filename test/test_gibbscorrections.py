@@ -1,9 +1,15 @@
 import numpy as np
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
+from cclib.parser.utils import convertor
 from gibbscorrections import corrections
 from gibbscorrections.molecule import Molecule
 
+# Example calculation files shipped with the repository
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
 
 @pytest.fixture
 def molecule_benzene():
@@ -28,11 +34,95 @@ def molecule_benzene():
 
 
 def test_get_coordinates(molecule_benzene):
-    input_file = Path("../data/gaussian_C6H6.log")
-    benzene_coordinates = corrections.get_coordinates(input_file)
+    input_file = DATA_DIR / "gaussian_C6H6.log"
+    benzene_coordinates = corrections.get_coordinates(corrections._load(input_file))
     test_coordinates = molecule_benzene.coordinates
-    assert np.array_equal(benzene_coordinates, test_coordinates)
+    np.testing.assert_allclose(benzene_coordinates, test_coordinates, rtol=0, atol=1e-6)
+
+
+def test_read_gaussian_log(tmp_path):
+    input_file = DATA_DIR / "gaussian_C6H6.log"
+    gaussian_data = corrections._read_gaussian_log(input_file)
+    cclib_data = corrections._load(input_file)
+    np.testing.assert_allclose(
+        gaussian_data.atomcoords[-1], cclib_data.atomcoords[-1], rtol=0, atol=1e-6
+    )
+    assert corrections.get_atom_lists(gaussian_data) == corrections.get_atom_lists(
+        cclib_data
+    )
+    assert corrections.get_energies(gaussian_data) == corrections.get_energies(
+        cclib_data
+    )
+    assert gaussian_data.charge == cclib_data.charge
+    assert gaussian_data.mult == cclib_data.mult
+
+    # Without thermochemistry, cclib has to be used instead
+    truncated_file = tmp_path / "truncated.log"
+    lines = input_file.read_text().splitlines(keepends=True)
+    truncated_file.write_text("".join(lines[:2000]))
+    assert corrections._read_gaussian_log(truncated_file) is None
+
+    # A cut-off orientation block after the last complete one cannot be read either
+    log = input_file.read_text()
+    orientation_start = log.rfind("Standard orientation:")
+    for cut in [150, 500, 900]:
+        cut_block = log[orientation_start : orientation_start + cut]
+        truncated_file.write_text(log + cut_block)
+        assert corrections._read_gaussian_log(truncated_file) is None
+
+
+def test_print_results(tmp_path):
+    out_file = tmp_path / "results.txt"
+    gaussian_energies = {
+        "scfenergy": -1.0,
+        "enthalpy": -0.5,
+        "freeenergy": -0.75,
+        "enthalpy_correction": 0.5,
+        "freeenergy_correction": 0.25,
+    }
+    corrections.print_results(out_file, [-2.0], [gaussian_energies], ["benzene"])
+    lines = out_file.read_text().splitlines()
+    assert lines[0].split("\t")[0] == "Name"
+    values = lines[1].split("\t")
+    assert values[0] == "benzene"
+    expected = [-1.0, -0.5, -0.75, -2.0, -1.5, -1.75]
+    assert [float(val) for val in values[1:]] == pytest.approx(
+        [convertor(val, "eV", "kcal/mol") for val in expected]
+    )
+
+
+def test_run_orca_jobs_failure(monkeypatch):
+    ran_jobs = []
+
+    def fake_run_one(job):
+        ran_jobs.append(job.name)
+        if job.name == "a":
+            raise ValueError("Orca crashed")
+        return job.name, {"scfenergy": -1.0}
+
+    monkeypatch.setattr(corrections, "_run_one", fake_run_one)
+    jobs = [SimpleNamespace(name=name) for name in ["a", "b", "c"]]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(RuntimeError, match="Orca jobs failed: a$"):
+            corrections._run_orca_jobs(executor, jobs, 1)
+    # Failure of the first job does not prevent the others from running
+    assert sorted(ran_jobs) == ["a", "b", "c"]
 
 
 def test_get_input_arguments():
     pass
+
+
+def test_parse_one(molecule_benzene):
+    input_file = DATA_DIR / "gaussian_C6H6.log"
+    coordinates, atom_list, energies, charge, mult, name = corrections._parse_one(
+        input_file
+    )
+    np.testing.assert_allclose(
+        coordinates, molecule_benzene.coordinates, rtol=0, atol=1e-6
+    )
+    assert tuple(atom_list) == molecule_benzene.elements_list
+    assert energies == corrections.get_energies(corrections._load(input_file))
+    assert charge == molecule_benzene.charge
+    assert mult == molecule_benzene.multiplicity
+    assert name == "gaussian_C6H6"
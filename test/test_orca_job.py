@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, E. Nicolas
+
+"""Tests for OrcaJob class"""
+
+import shutil
+from pathlib import Path
+import numpy as np
+from cclib.io import ccread
+from gibbscorrections.molecule import Molecule
+from gibbscorrections.orca_job import OrcaJob, _coordinates_from_output, parse_many
+import pytest
+
+# Example calculation files shipped with the repository
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+@pytest.fixture
+def orca_job_hydrogen(tmp_path):
+    elements_list = [1, 1]
+    coordinates = [[0.0000, 0.0000, 0.0000], [0.0000, 0.0000, 0.7400]]
+    molecule = Molecule(coordinates, elements_list, 0, 1)
+    orca_args = {"functional": "wB97M-V", "basisset": "Def2-TZVPP", "solvent": None}
+    job = OrcaJob(
+        basedir=tmp_path,
+        name="hydrogen",
+        molecule=molecule,
+        job_id="hydrogen",
+        orca_args=orca_args,
+    )
+    job.setup_computation()
+    return job
+
+
+def test_computation_finished(orca_job_hydrogen):
+    """Testing detection of the Orca termination banner"""
+    output_file = Path(orca_job_hydrogen.path, orca_job_hydrogen.filenames["output"])
+    assert not orca_job_hydrogen.computation_finished()
+
+    output_file.write_text("****ORCA TERMINATED NORMALLY****\n")
+    assert not orca_job_hydrogen.computation_finished()
+
+    output_file.write_text("SCF ITERATIONS\n" * 1000)
+    assert not orca_job_hydrogen.computation_finished()
+
+    output_file.write_text(
+        "SCF ITERATIONS\n" * 1000
+        + "                             ****ORCA TERMINATED NORMALLY****\n"
+        + "TOTAL RUN TIME: 0 days 0 hours 0 minutes 10 seconds 0 msec\n"
+    )
+    assert orca_job_hydrogen.computation_finished()
+
+
+def test_header_cache_invalidation(orca_job_hydrogen):
+    """Testing that cached header and geometry follow the job settings"""
+    assert orca_job_hydrogen.header[0].startswith("! RKS wB97M-V ")
+    orca_job_hydrogen.orca_args = dict(orca_job_hydrogen.orca_args, functional="M062X")
+    assert orca_job_hydrogen.header[0].startswith("! RKS M062X ")
+
+    assert orca_job_hydrogen.geometry[0] == "* xyz 0 1"
+    orca_job_hydrogen.molecule = Molecule([[0.0, 0.0, 0.0]], [1], 0, 2)
+    assert orca_job_hydrogen.geometry[0] == "* xyz 0 2"
+
+
+def test_get_energies(orca_job_hydrogen):
+    """Testing energies read from the end of the output against a full cclib parse"""
+    output_file = Path(orca_job_hydrogen.path, orca_job_hydrogen.filenames["output"])
+    shutil.copy(DATA_DIR / "orca_C6H6.out", output_file)
+    energies = orca_job_hydrogen.get_energies()
+    data = ccread(output_file.as_posix())
+    assert energies["scfenergy"] == pytest.approx(data.scfenergies[-1], abs=1e-5)
+    assert energies["enthalpy"] is None
+    assert energies["freeenergy"] is None
+
+
+@pytest.mark.parametrize("free_energy_wording", ["energy", "enthalpy"])
+def test_get_energies_thermochemistry(orca_job_hydrogen, free_energy_wording):
+    """Testing enthalpy and free energy read from the end of a frequency output"""
+    output_file = Path(orca_job_hydrogen.path, orca_job_hydrogen.filenames["output"])
+    output_file.write_text(
+        "FINAL SINGLE POINT ENERGY      -232.228005721768\n"
+        "Total Enthalpy                    ...   -232.12345678 Eh\n"
+        "Final Gibbs free "
+        + free_energy_wording
+        + "         ...   -232.15432100 Eh\n"
+    )
+    energies = orca_job_hydrogen.get_energies()
+    assert energies["enthalpy"] == pytest.approx(-232.12345678)
+    assert energies["freeenergy"] == pytest.approx(-232.154321)
+
+
+def test_extract_natural_charges(orca_job_hydrogen):
+    """Testing NBO charges parsing"""
+    output_file = Path(orca_job_hydrogen.path, orca_job_hydrogen.filenames["output"])
+    assert orca_job_hydrogen.extract_natural_charges() is None
+
+    output_file.write_text("")
+    assert orca_job_hydrogen.extract_natural_charges() is None
+
+    output_file.write_text("No NBO analysis here\n")
+    assert orca_job_hydrogen.extract_natural_charges() is None
+
+    output_file.write_text(
+        " Summary of Natural Population Analysis:\n"
+        "\n"
+        "                                     Natural Population\n"
+        "             Natural    ---------------------------------------------\n"
+        "  Atom No    Charge        Core      Valence    Rydberg      Total\n"
+        " --------------------------------------------------------------------\n"
+        "      H  1    0.00143      0.00000     0.99714    0.00143     1.00000\n"
+        # Three-digit atom numbers are stuck to the element symbol
+        "      H100   -0.00143      0.00000     1.00000    0.00143     1.00143\n"
+        " ====================================================================\n"
+    )
+    np.testing.assert_allclose(
+        orca_job_hydrogen.extract_natural_charges(), [0.00143, -0.00143]
+    )
+
+
+def test_get_coordinates(orca_job_hydrogen):
+    """Testing coordinates extraction, and reuse of the cclib parse"""
+    output_file = Path(orca_job_hydrogen.path, orca_job_hydrogen.filenames["output"])
+    shutil.copy(DATA_DIR / "orca_C6H6.out", output_file)
+    orca_job_hydrogen.molecule = Molecule(np.zeros((12, 3)), [6] * 6 + [1] * 6, 0, 1)
+    coordinates = orca_job_hydrogen.get_coordinates()
+    np.testing.assert_allclose(
+        coordinates, orca_job_hydrogen._data().atomcoords[0], rtol=0, atol=1e-6
+    )
+    assert orca_job_hydrogen._data() is orca_job_hydrogen._data()
+
+
+def test_coordinates_from_truncated_output(tmp_path):
+    """Testing that a truncated coordinates block is not read from the file start"""
+    output_file = tmp_path / "truncated.out"
+    header = "1.0 2.0 3.0 4.0\n5 6 7 8\nCARTESIAN COORDINATES (ANGSTROEM)"
+    for ending in ["", "\n", "\n-----\n", "\n-----\n  H 0.0 0.0 0.0\n"]:
+        output_file.write_text(header + ending)
+        assert _coordinates_from_output(output_file, 2) is None
+
+def test_cleanup(orca_job_hydrogen):
+    """Testing removal of job directory"""
+    assert orca_job_hydrogen.path.is_dir()
+    orca_job_hydrogen.cleanup().result()
+    assert not orca_job_hydrogen.path.exists()
+
+
+def test_parse_many(tmp_path):
+    """Testing parallel cclib parsing of several jobs"""
+    molecule = Molecule(np.zeros((12, 3)), [6] * 6 + [1] * 6, 0, 1)
+    orca_args = {"functional": "wB97M-V", "basisset": "Def2-TZVPP", "solvent": None}
+    jobs = [
+        OrcaJob(
+            basedir=tmp_path,
+            name=name,
+            molecule=molecule,
+            job_id=name,
+            orca_args=orca_args,
+        )
+        for name in ["complete", "no_final_energy", "not_run"]
+    ]
+    for job in jobs:
+        job.setup_computation()
+    complete_output = (DATA_DIR / "orca_C6H6.out").read_text()
+    Path(jobs[0].path, jobs[0].filenames["output"]).write_text(complete_output)
+    # Without its final energy line, the output can only be read by cclib
+    Path(jobs[1].path, jobs[1].filenames["output"]).write_text(
+        complete_output.replace("FINAL SINGLE POINT ENERGY", "")
+    )
+
+    parse_many(jobs, max_workers=2)
+    assert jobs[0]._ccdata is None
+    assert jobs[1]._ccdata is not None
+    assert jobs[2]._ccdata is None
+    assert jobs[1].get_energies()["scfenergy"] == pytest.approx(
+        jobs[0].get_energies()["scfenergy"], abs=1e-5
+    )
+
+
+def test_run_failure(orca_job_hydrogen, tmp_path, monkeypatch):
+    """Testing that a failed Orca run is reported"""
+    orca_bin = tmp_path / "orca"
+    orca_bin.write_text("#!/bin/sh\necho 'ORCA crashed'\nexit 1\n")
+    orca_bin.chmod(0o755)
+    monkeypatch.setenv("ORCA_BIN_DIR", str(tmp_path))
+    assert not orca_job_hydrogen.run()